@@ -8,6 +8,11 @@ import warnings
 import numpy as np
 from .tools import _make_line
 
+# WDC files carry one hour of 1-minute values per line so the minute
+# offsets are always the same. Precompute them once instead of building
+# a datetime from scratch for every minute.
+_MINUTE_DELTAS = tuple(dt.timedelta(minutes=minute) for minute in range(60))
+
 
 def write_imf_input(imf_data, filename='IMF.dat', **kwargs):
     """Creates the IMF.dat input file for the SWMF BATS-R-US geospace model.
@@ -72,17 +77,19 @@ def write_imf_input(imf_data, filename='IMF.dat', **kwargs):
         # write dat file
         file_imf.write('\n'+' '.join(_justified(columns_dat)))
         file_imf.write('\n#START\n')
+        data_columns = [np.asarray(imf_data[key], dtype=float)
+                        for key in column_keys[1:]]
+        # Don't write lines that have NaN, found with one vectorized pass
+        clean = ~np.isnan(np.array(data_columns)).any(axis=0)
+        # Format every data column at once instead of one str() per cell
+        formatted = [np.char.mod('%.2f', column) for column in data_columns]
         lines = []
         for index, _time in enumerate(imf_data[column_keys[0]]):
-            dirty = False  # Don't write line if it has NaN
+            if not clean[index]:
+                continue
             line = _time_repr(_time)
-            for key in column_keys[1:]:
-                line += [str(round(imf_data[key][index], 2))]
-                if np.isnan(imf_data[key][index]):
-                    dirty = True
-            if not dirty:
-                line = ' '.join(_justified(line))
-                lines += line + '\n'
+            line += [column[index] for column in formatted]
+            lines.append(' '.join(_justified(line)) + '\n')
         file_imf.writelines(lines)
 
 
@@ -117,8 +124,9 @@ def read_wdc_ae(wdc_filename):
         assert header[:8] == 'AEALAOAU', \
             'Does not seem to be a WDC AE file. First 8 chars: ' + header[:8]
 
-        # Parse
-        for line in wdc_file:
+        # Parse. Slurp the rest of the file in one read so the line
+        # splitting happens in C rather than through the line iterator.
+        for line in wdc_file.read().splitlines():
             data = line.split()
             year_suffix = int(data[1][:2])
             if year_suffix < 50:
@@ -129,13 +137,14 @@ def read_wdc_ae(wdc_filename):
             day = int(data[1][4:6])
             hour = int(data[1][7:9])
             index = data[1][-2:]
-            values_60 = [int(val) for val in data[3:60+3]]
+            # One vectorized conversion for the 60 minute values
+            values_60 = np.array(data[3:60+3]).astype(np.int64).tolist()
 
-            # Fill
-            for minute, value in enumerate(values_60):
-                return_data[index]['values'].append(value)
-                return_data[index]['times'].append(
-                    dt.datetime(year, month, day, hour, minute))
+            # Fill the whole hour in two bulk extends
+            base_time = dt.datetime(year, month, day, hour)
+            return_data[index]['values'].extend(values_60)
+            return_data[index]['times'].extend(
+                base_time + delta for delta in _MINUTE_DELTAS)
 
     return return_data
 
@@ -211,9 +220,10 @@ def read_wdc_asy_sym(wdc_filename):
             # Fill 60 min data
             data = line.split()
             values_60 = [int(val) for val in data[2:62]]
+            base_time = dt.datetime(year, month, day, hour)
             for minute, value in enumerate(values_60):
                 return_data[index+'-'+comp]['times'].append(
-                    dt.datetime(year, month, day, hour, minute))
+                    base_time + _MINUTE_DELTAS[minute])
                 # Check if data is bad
                 if value != 99999:
                     return_data[index+'-'+comp]['values'].append(
@@ -227,10 +237,12 @@ def read_wdc_asy_sym(wdc_filename):
 
 def _coarse_filtering(data, coarseness=3):
     """Applies coarse filtering to a pandas.DataFrame"""
-    for column in data.columns:
-        mean = data[column].abs().mean()
-        sigma = data[column].std()
-        data[column] = data[data[column].abs() < mean+coarseness*sigma][column]
+    values = data.to_numpy(dtype=float, copy=True)
+    abs_values = np.abs(values)
+    mean = np.nanmean(abs_values, axis=0)
+    sigma = np.nanstd(values, axis=0, ddof=1)
+    values[abs_values >= mean + coarseness*sigma] = np.nan
+    data.loc[:, :] = values
 
 
 def read_gm_log(filename, colnames=None, dtypes=None, index_time=True):
@@ -282,15 +294,29 @@ def read_gm_log(filename, colnames=None, dtypes=None, index_time=True):
             return_data[col] = []
 
         # Fill data dictionary
-        for line_num, line in enumerate(logfile):
-            if line_num > 2:  # First two lines are usually metadata
+        lines = logfile.readlines()[3:]  # First lines are usually metadata
+        values = None
+        if not dtypes and lines:
+            # Logs are usually pure numeric so try one pass with numpy's
+            # C tokenizer before falling back to per-value parsing.
+            try:
+                values = np.loadtxt(lines, ndmin=2)
+            except ValueError:
+                values = None
+            if values is not None and values.shape[1] != len(colnames):
+                values = None
+        if values is not None:
+            for col, colname in enumerate(colnames):
+                return_data[colname] = list(values[:, col])
+        else:
+            for line in lines:
                 for col, data in enumerate(line.strip().split()):
                     if dtypes:
                         data = dtypes[col](data)
                     else:
                         try:
                             data = float(data)
-                        except ValueError as err:
+                        except ValueError:
                             data = np.nan
                             warnings.warn('Value error and no manual dtype set'
                                           + ' changing to NaN',
@@ -299,16 +325,11 @@ def read_gm_log(filename, colnames=None, dtypes=None, index_time=True):
 
         # datetime index
         if index_time:
-            return_data['times'] = []
-            for row, year in enumerate(return_data[colnames[1]]):
-                return_data['times'].append(
-                    dt.datetime(int(year),
-                                int(return_data[colnames[2]][row]),  # month
-                                int(return_data[colnames[3]][row]),  # day
-                                int(return_data[colnames[4]][row]),  # hour
-                                int(return_data[colnames[5]][row]),  # min
-                                int(return_data[colnames[6]][row]),  # sec
-                                int(return_data[colnames[7]][row])))  # ms
+            # year, month, day, hour, min, sec, ms columns bound once
+            # instead of seven dict lookups per row
+            time_columns = [return_data[colnames[col]] for col in range(1, 8)]
+            return_data['times'] = [dt.datetime(*map(int, row))
+                                    for row in zip(*time_columns)]
 
     return return_data
 
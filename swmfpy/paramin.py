@@ -9,9 +9,15 @@ __all__ = [
 __author__ = 'Qusai Al Shidi'
 __email__ = 'qusai@umich.edu'
 
+from collections import deque
 import logging
+import re
 from .tools import _make_line
 
+# Matches a '\043COMMAND' token at the start of a PARAM.in line without
+# tokenizing the whole line.
+_COMMAND_PATTERN = re.compile(r'\s*(#\S*)')
+
 
 def replace_command(parameters, input_file, output_file='PARAM.in'):
     """Replace values for the parameters in a PARAM.in file.
@@ -46,28 +52,39 @@ def replace_command(parameters, input_file, output_file='PARAM.in'):
     logger = logging.getLogger()  # For debugging
 
     # Read and replace paramin file by making a temp list
-    with open(input_file, 'rt') as paramin:
-
-        # Compile lines in a list before editing/writing it
-        lines = list(paramin)
-        for line_num, line in enumerate(lines):
-
+    with open(input_file, 'rt', buffering=1 << 20) as paramin:
+        # One read; splitting into lines happens in C
+        lines = paramin.read().splitlines(keepends=True)
+
+    # Single pass: queue the replacement lines when a wanted command is
+    # found and emit them in place of the lines that follow it.
+    output_lines = []
+    pending = deque()
+    wanted = frozenset(parameters)  # O(1) membership with a small constant
+    for line in lines:
+        if pending:
+            output_lines.append(pending.popleft())
+            continue
+
+        # Most lines are values or comments, skip them cheaply
+        stripped = line.lstrip()
+        if stripped.startswith('#'):
             # If the current command is what we want
-            command = _get_command(line)
-            if command in parameters.keys():
-
-                for param, value in enumerate(parameters[command]):
+            command = stripped.split(None, 1)[0]
+            if command in wanted:
+                for value in parameters[command]:
                     newline = _make_line(value)
                     logger.info('Replacing: %s\n with: %s\n',
                                 line, newline)
                     # Lines will be replaced in order
-                    lines[line_num+param+1] = newline + '\n'
+                    pending.append(newline + '\n')
+        output_lines.append(line)
+    lines = output_lines
 
     # Write the PARAM.in file
     if output_file is not None:
         with open(output_file, 'w') as outfile:
-            for line in lines:
-                outfile.write(line)
+            outfile.writelines(lines)
 
     return lines
 
@@ -110,34 +127,49 @@ def read_command(command, paramin_file='PARAM.in', **kwargs):
 
     logger = logging.getLogger()  # For debugging
 
-    with open(paramin_file) as paramin:
-        return_values = []
-        command_found = False  # to know if worked
-        in_command = False  # when after command needed
-        for line in paramin:
-            if _get_command(line) == command:
+    # Slurp the file once in binary mode; splitting lines in C beats
+    # iterating the file object line by line and scanning bytes skips
+    # the text decoder for the whole file.
+    with open(paramin_file, 'rb', buffering=1 << 20) as paramin:
+        lines = paramin.read().splitlines()
+    command_bytes = command.encode()
+
+    # To ignore additional lines
+    value_limit = kwargs.get('num_of_values', None)
+
+    return_values = []
+    command_found = False  # to know if worked
+    in_command = False  # when after command needed
+    for line in lines:
+        # Most lines are values or blank; one cheap startswith() test
+        # keeps the command handling off the common path.
+        stripped = line.lstrip()
+        if stripped.startswith(b'#'):
+            if stripped.split(None, 1)[0] == command_bytes:
                 logger.info('Found command: %s', command)
                 command_found = True
                 in_command = True
                 return_values.append(command)
-            elif in_command and _get_command(line):  # Make sure not out of cmd
+            else:  # Make sure not out of cmd
                 in_command = False
-            elif line.split() and in_command:
-                value = line.split()[0]
-                logger.info('Value added: %s', value)
-                return_values.append(value)
+        elif in_command and stripped:
+            # Only the few returned values get decoded
+            value = stripped.split(None, 1)[0].decode()
+            logger.info('Value added: %s', value)
+            return_values.append(value)
+            # Enough values read, don't scan the rest of the file
+            if value_limit and len(return_values) > value_limit:
+                break
 
-        # Error handling
-        # Unable to find #COMMAND
-        if not command_found:
-            raise ValueError(command + ' not found.')
+    # Error handling
+    # Unable to find #COMMAND
+    if not command_found:
+        raise ValueError(command + ' not found.')
 
-        # To ignore additional lines
-        value_limit = kwargs.get('num_of_values', None)
-        if value_limit:
-            return_values = return_values[:value_limit+1]
+    if value_limit:
+        return_values = return_values[:value_limit+1]
 
-        return return_values  # empty list might mean command not found
+    return return_values  # empty list might mean command not found
 
 
 # HIDDEN FUNCTIONS
@@ -150,11 +182,9 @@ def _get_command(line):
     Returns:
         (str): '\043COMMAND' if found and None if not.
     """
-    if isinstance(line, (str, list, tuple)):  # Raises type error otherwise
-        if isinstance(line, str):
-            to_check = line.split()
-            if to_check and to_check[0].startswith('#'):
-                return to_check[0]
-            return None
+    if type(line) is str:  # Common case first, skips the MRO walk
+        match = _COMMAND_PATTERN.match(line)
+        return match.group(1) if match else None
+    if isinstance(line, (list, tuple)) and line:
         return _get_command(line[0])
     return None
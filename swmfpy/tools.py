@@ -6,8 +6,12 @@ __author__ = 'Qusai Al Shidi'
 __email__ = 'qusai@umich.edu'
 
 import datetime as dt
+from functools import lru_cache
 import numpy as np
 
+# Separator between values on a PARAM.in line
+_LINE_SEPARATOR = '\t\t\t'
+
 
 def interp_nans(x_vals, y_vals):
     """Returns a numpy array with NaNs interpolated.
@@ -22,7 +26,7 @@ def interp_nans(x_vals, y_vals):
         (np.array): numpy array with NaNs interpolated.
     """
 
-    nonans = np.nonzero(np.isnan(y_vals) == 0)
+    nonans = ~np.isnan(y_vals)
     return np.interp(x_vals, x_vals[nonans], y_vals[nonans])
 
 
@@ -30,17 +34,30 @@ def carrington_rotation_number(the_time='now'):
     """Returns the carrington rotation
 
     Args:
-        the_time (datetime.datetime/str): The time to convert to carrington
-                                          rotation.
+        the_time (datetime.datetime/str/array_like): The time (or times) to
+                                                     convert to carrington
+                                                     rotation.
 
     Returns:
-        (int): Carrington Rotation
+        (int/np.array): Carrington Rotation
     """
-    if the_time == 'now':
-        return carrington_rotation_number(dt.datetime.now())
     if isinstance(the_time, str):
+        if the_time == 'now':
+            return carrington_rotation_number(dt.datetime.now())
         return carrington_rotation_number(dt.datetime.fromisoformat(the_time))
-    return int((the_time.toordinal() - 676715.2247)/27.2753)
+    if isinstance(the_time, (list, tuple, np.ndarray)):
+        # One vectorized pass; 719163 is the proleptic ordinal of the
+        # unix epoch that datetime64 days count from
+        ordinals = (np.asarray(the_time, dtype='datetime64[D]')
+                    .astype(np.int64) + 719163)
+        return ((ordinals - 676715.2247)/27.2753).astype(np.int64)
+    return _crn_from_ordinal(the_time.toordinal())
+
+
+@lru_cache(maxsize=1024)
+def _crn_from_ordinal(ordinal):
+    """Carrington rotation for a proleptic-Gregorian day ordinal."""
+    return int((ordinal - 676715.2247)/27.2753)
 
 
 def _import_error_string(library):
@@ -56,16 +73,35 @@ def _make_line(value):
     if isinstance(value, str):
         return value
     if isinstance(value, (list, tuple)):
-        return '\t\t\t'.join([_make_line(v) for v in value])
-    try:
-        str(value)
-    except Exception as error:
-        raise TypeError(error,
-                        '\nMust reduce to a str or a method that has',
-                        '__str__ or __repr__')
+        # Flat lists are the common case, join them in one pass
+        if not any(isinstance(v, (list, tuple)) for v in value):
+            return _LINE_SEPARATOR.join(map(str, value))
+        return _LINE_SEPARATOR.join(_make_line(v) for v in value)
     return str(value)
 
 
+def _nearest_sorted(pivot, items):
+    """Returns nearest point assuming `items` is sorted ascending.
+
+    O(log n) bisection for callers with monotonic data (e.g. time
+    arrays); use `_nearest` when the ordering is unknown.
+    """
+    items = np.asarray(items)
+    index = np.searchsorted(items, pivot)
+    if index == 0:
+        return items[0]
+    if index == items.size:
+        return items[-1]
+    before = items[index-1]
+    after = items[index]
+    if abs(pivot - before) <= abs(after - pivot):
+        return before
+    return after
+
+
 def _nearest(pivot, items):
     """Returns nearest point"""
-    return min(items, key=lambda x: abs(x - pivot))
+    # argmin over one vectorized distance pass beats a per-element
+    # key function; datetimes go through the object-array path
+    items = np.asarray(items)
+    return items[np.abs(items - pivot).argmin()]
@@ -9,10 +9,12 @@ __author__ = 'Qusai Al Shidi'
 __email__ = 'qusai@umich.edu'
 
 # standard lib
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
 import ftplib
 from functools import lru_cache
 import gzip
+import io
 from operator import itemgetter
 import os
 import os.path
@@ -25,7 +27,7 @@ import warnings
 from dateutil import rrule
 # dependencies and internal
 import numpy as np
-from .tools import _nearest, carrington_rotation_number
+from .tools import carrington_rotation_number
 
 # Global defines
 # This is straight from the format guide on spdf with nicer names as second col
@@ -187,83 +189,93 @@ def get_omni_data(time_from, time_to, **kwargs):
     # Initialize
     return_data = {}
     return_data['times'] = []
-    name_type = int(not kwargs.get('original_colnames', False))
-    name_type = itemgetter(name_type)
-    resolution = kwargs.get('resolution', 'high')
-    # omni cols do not include time cols
-    omni = {
-        'high': {
-            'urls': _urls_omni_hires,
-            'cols': list(map(name_type, OMNI_HIRES_COLS)),
-            'parsetime': lambda cols: (dt.datetime(int(cols[0]), 1, 1,
-                                                   int(cols[2]),
-                                                   int(cols[3]))
-                                       + dt.timedelta(int(cols[1])-1)),
-            'ntimecols': 4,  # Minute
-            },
-        'low': {
-            'urls': _urls_omni_lores,
-            'cols': list(map(name_type, OMNI_LORES_COLS)),
-            'parsetime': lambda cols: (dt.datetime(int(cols[0]), 1, 1,
-                                                   int(cols[2]))
-                                       + dt.timedelta(int(cols[1])-1)),
-            'ntimecols': 3,  # Hourly
-            },
-        }
-    omni = omni[resolution]  # To save line space
-    for col_name in omni['cols']:
-        return_data[col_name] = []
-
-    # Iterate by url to save RAM
-    for url in omni['urls'](time_from, time_to):
-
-        # Parse omni data
-        for line in _download_static_page(url):
+    omni = _omni_spec(kwargs.get('resolution', 'high'),
+                      kwargs.get('original_colnames', False))
+    # Per-month array chunks for each column, concatenated once at the
+    # end instead of growing Python lists value by value
+    chunks = {col_name: [] for col_name in omni['cols']}
+
+    # Fetch the months concurrently: the downloads are latency bound
+    # and urlopen releases the GIL during socket I/O
+    urls = list(omni['urls'](time_from, time_to))
+    ntimecols = omni['ntimecols']
+    months = []
+    if urls:  # An inverted time range yields no urls
+        with ThreadPoolExecutor(max_workers=min(8, len(urls))) as executor:
+            months = list(executor.map(_omni_month, urls,
+                                       [ntimecols]*len(urls)))
+
+    # Iterate by month, in url order
+    for url, parsed in zip(urls, months):
+
+        if parsed is not None:
+            times, values = parsed
+            # Month times are sorted, so two bisections find the range
+            # instead of comparing every row; interior months keep
+            # their full slice untouched
+            low = np.searchsorted(times, np.datetime64(time_from), 'left')
+            high = np.searchsorted(times, np.datetime64(time_to), 'right')
+            # tolist() gives datetime.datetime objects back
+            return_data['times'] += times[low:high].astype(
+                'datetime64[us]').tolist()
+            values = values[low:high]
+            for col_name, numbers in zip(omni['cols'], values.T):
+                chunks[col_name].append(numbers)
+            continue
+
+        # Fallback for malformed pages: parse omni data line by line
+        # into locally bound column lists, one array per month
+        month_cols = [[] for _ in omni['cols']]
+        for line in _download_static_page(url).splitlines():
             cols = line.decode('ascii').split()
 
             time = omni['parsetime'](cols)
             if time_from <= time <= time_to:
                 return_data['times'] += [time]
                 # Assign the data from after the time columns
-                for col_name, value in zip(omni['cols'],
+                for col_list, value in zip(month_cols,
                                            cols[omni['ntimecols']:]):
                     if _bad_omni_num(value):
-                        return_data[col_name] += [None]
+                        col_list.append(None)
                     else:
-                        return_data[col_name] += [float(value)]
+                        col_list.append(float(value))
+        for col_name, col_list in zip(omni['cols'], month_cols):
+            if col_list:
+                chunks[col_name].append(np.array(col_list, dtype=float))
 
     for col_name in omni['cols']:
-        return_data[col_name] = np.array(return_data[col_name],
-                                         dtype=float)
+        return_data[col_name] = (np.concatenate(chunks[col_name])
+                                 if chunks[col_name]
+                                 else np.array([], dtype=float))
     return return_data
 
 
 @lru_cache(maxsize=12)
 def _download_static_page(url):
-    """Downloads a cached webpage as a list of lines
+    """Downloads a cached webpage as one bytes string
 
     Args:
         url (str):
             Webapage URL.
 
     Returns:
-        list: A list of lines from the webpage. *Note*: Linebreaks are still
-              present.
+        bytes: The raw page contents. One blob is cheaper to cache and
+               parse than a list of per-line bytes objects.
     """
     try:
         from filecache import filecache
         @filecache(30 * 24 * 60 * 60)  # Cache for a month
         def _download_static_page_lazy(arg):
-            return list(urllib.request.urlopen(arg))
+            return urllib.request.urlopen(arg).read()
         return _download_static_page_lazy(url)
     except URLError:
         warnings.warn('Could not verify with SSL, creating unverified context'
                       + ' your python system may need certificate '
                       + 'installation')
         context = ssl._create_unverified_context()  # Not secure
-        return list(urllib.request.urlopen(url, context=context))
+        return urllib.request.urlopen(url, context=context).read()
     except Exception:
-        return list(urllib.request.urlopen(url))
+        return urllib.request.urlopen(url).read()
 
 
 def _urls_omni_hires(time_from, time_to):
@@ -296,11 +308,118 @@ def _urls_omni_lores(time_from, time_to):
         yield prefix+suffix
 
 
+@lru_cache(maxsize=4)
+def _omni_spec(resolution, original_colnames):
+    """Column names, url builder and time layout for one omni
+       resolution, built once per (resolution, naming) pair.
+    """
+    name_type = itemgetter(int(not original_colnames))
+    # omni cols do not include time cols
+    spec = {
+        'high': {
+            'urls': _urls_omni_hires,
+            'cols': tuple(map(name_type, OMNI_HIRES_COLS)),
+            'parsetime': lambda cols: (dt.datetime(int(cols[0]), 1, 1,
+                                                   int(cols[2]),
+                                                   int(cols[3]))
+                                       + dt.timedelta(int(cols[1])-1)),
+            'ntimecols': 4,  # Minute
+            },
+        'low': {
+            'urls': _urls_omni_lores,
+            'cols': tuple(map(name_type, OMNI_LORES_COLS)),
+            'parsetime': lambda cols: (dt.datetime(int(cols[0]), 1, 1,
+                                                   int(cols[2]))
+                                       + dt.timedelta(int(cols[1])-1)),
+            'ntimecols': 3,  # Hourly
+            },
+        }
+    return spec[resolution]
+
+
+# Parsed omni months are memoized here as .npz files
+_OMNI_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'swmfpy')
+
+
+def _omni_month(url, ntimecols):
+    """Returns parsed (times, values) arrays for one monthly omni page.
+
+    Results are cached on disk under ~/.cache/swmfpy for a month (the
+    same lifetime as the raw page cache) so repeat calls skip both the
+    download and the parse. Returns None if the page can't be parsed
+    in bulk.
+    """
+    cache_file = os.path.join(_OMNI_CACHE_DIR,
+                              url.rsplit('/', 1)[-1] + '.npz')
+    try:
+        age = dt.datetime.now().timestamp() - os.path.getmtime(cache_file)
+        if age < 30 * 24 * 60 * 60:
+            cached = np.load(cache_file)
+            return cached['times'], cached['values']
+    except FileNotFoundError:
+        pass  # Not cached yet, fall through to download
+    except Exception:  # Corrupt or unreadable cache, heal by rewriting
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+
+    parsed = _parse_omni_page(_download_static_page(url), ntimecols)
+    if parsed is not None:
+        try:
+            os.makedirs(_OMNI_CACHE_DIR, exist_ok=True)
+            # Write to a temp name and rename so an interrupted save
+            # never leaves a partial .npz behind
+            temp_file = f'{cache_file}.{os.getpid()}.tmp'
+            with open(temp_file, 'wb') as npz_file:
+                np.savez(npz_file, times=parsed[0], values=parsed[1])
+            os.replace(temp_file, cache_file)
+        except OSError:
+            pass  # Cache dir not writable, caching is best effort
+    return parsed
+
+
+def _parse_omni_page(page, ntimecols):
+    """Parses a whole monthly omni page into a datetime64 array and a
+       float64 value matrix with NaN for the 9-filled sentinels.
+
+    Tokenizing happens in numpy's C reader instead of a str.split()
+    and float() per cell. Returns None when the page is malformed.
+    """
+    try:
+        data = np.loadtxt(io.BytesIO(page), dtype=str, ndmin=2)
+    except ValueError:
+        return None
+    if not data.size:
+        return None
+    times = _parse_omni_times(data, ntimecols)
+    raw = data[:, ntimecols:]
+    values = raw.astype(np.float64)
+    # Sentinels are strings of only 9s and dots (999.9, 9999.99, ...);
+    # one vectorized strip replaces a per-character Python check
+    values[np.char.lstrip(raw, '9.') == ''] = np.nan
+    return times, values
+
+
+def _parse_omni_times(data, ntimecols):
+    """Converts omni year/doy/hour[/minute] string columns to a sorted
+       datetime64 array in one vectorized pass.
+    """
+    times = (data[:, 0].astype('datetime64[Y]').astype('datetime64[m]')
+             + (data[:, 1].astype(np.int64) - 1) * np.timedelta64(1440, 'm')
+             + data[:, 2].astype(np.int64) * np.timedelta64(60, 'm'))
+    if ntimecols > 3:
+        times += data[:, 3].astype(np.int64) * np.timedelta64(1, 'm')
+    return times
+
+
 def _bad_omni_num(value_string):
     """Returns true if bad or false if not. Bad numbers usually just have 9s
        in omni.
     """
-    return all([char in ('9', '.') for char in value_string])
+    # lstrip scans the characters in one C loop; empty means the value
+    # was nothing but 9s and dots
+    return not value_string.lstrip('9.')
 
 
 def download_magnetogram_hmi(mag_time, hmi_map='hmi.B_720s', **kwargs):
@@ -360,7 +479,8 @@ def download_magnetogram_hmi(mag_time, hmi_map='hmi.B_720s', **kwargs):
     urls = get_urls[hmi_map](client, mag_time)
 
     # Download data
-    if kwargs.get('verbose', False):
+    verbose = kwargs.get('verbose', False)  # Bound once, checked per file
+    if verbose:
         print('Starting download of magnetograms:\n')
     return_name = ''
     download_dir = kwargs.get('download_dir', '')
@@ -372,16 +492,18 @@ def download_magnetogram_hmi(mag_time, hmi_map='hmi.B_720s', **kwargs):
         filename = 'hmi_' + str(data_time).replace(' ', '_')  # Add timestamp
         filename += '_' + mag_url.split('/')[-1]  # Last is filename
         url = 'http://jsoc.stanford.edu' + mag_url
-        if kwargs.get('verbose', False):
+        if verbose:
             print(f'Downloading from {url} to {download_dir+filename}.')
         with urllib.request.urlopen(url) as fits_file:
             with open(download_dir+filename, 'wb') as local_file:
-                local_file.write(fits_file.read())
-        if kwargs.get('verbose', False):
+                # Stream in 1 MiB chunks instead of slurping the whole
+                # FITS file into memory first
+                shutil.copyfileobj(fits_file, local_file, 1 << 20)
+        if verbose:
             print(f'Done writing {download_dir+filename}.\n')
         return_name = download_dir+filename
 
-    if kwargs.get('verbose', False):
+    if verbose:
         print('Completed downloads.\n')
 
     return return_name
@@ -420,19 +542,15 @@ def _get_urls_hmi_b720(client, mag_time):
             suffix url of magnetogram
     """
     import drms
-    query_string = 'hmi.B_720s'
-    query_string += f'[{mag_time.year}.'
-    query_string += f'{str(mag_time.month).zfill(2)}.'
-    query_string += f'{str(mag_time.day).zfill(2)}_'
-    query_string += f'{str(mag_time.hour).zfill(2)}'
-    query_string += '/1h]'
+    query_string = (f'hmi.B_720s[{mag_time.year}.{mag_time.month:02d}.'
+                    + f'{mag_time.day:02d}_{mag_time.hour:02d}/1h]')
     data = client.query(query_string, key='T_REC', seg='field')
     times = drms.to_datetime(data[0].T_REC)
-    nearest_time = _nearest(mag_time, times)
-    # Generator to find the nearest time
-    urls = ((data_time, mag_url) for (data_time, mag_url)
-            in zip(times, data[1].field) if data_time == nearest_time)
-    return urls
+    # One vectorized distance pass indexes the nearest record directly
+    deltas = np.abs(np.asarray(times, dtype='datetime64[ns]')
+                    - np.datetime64(mag_time))
+    index = int(deltas.argmin())
+    return ((times[index], data[1].field[index]),)
 
 
 def download_magnetogram_adapt(time, map_type='fixed', **kwargs):
@@ -444,6 +562,8 @@ def download_magnetogram_adapt(time, map_type='fixed', **kwargs):
 
     Args:
         time (datetime.datetime): Time in which you want the magnetogram.
+                                  A list or tuple of times downloads every
+                                  matching map over one session.
         map_type (str): (default: 'fixed')
                         Choose either 'fixed' or 'central' for
                         the map type you want.
@@ -481,69 +601,99 @@ def download_magnetogram_adapt(time, map_type='fixed', **kwargs):
         'central': '1',
     }
 
-    # Establish ftp connection
-    ftp = ftplib.FTP('gong2.nso.edu')
-    ftp.login()
-    ftp.cwd('adapt/maps/gong')
-    try:
-        ftp.cwd(str(time.year))
-    except ftplib.all_errors as err:
-        ftp.quit()
-        raise NotADirectoryError('Cannot go to the specific year directory') from err
-
-    # ADAPT maps only contains the hours for even numbers
-    if time.hour % 2 != 0:
-        warnings.warn('Warning: Hour must be an even number. '
-                      + 'The entered hour value is changed to '
-                      + f'{time.hour//2*2}',
-                      RuntimeWarning)
-    # Only consider the public (4) Carrington Fixed (0) GONG (3) ADAPT maps
-    file_pattern = 'adapt4' + map_id[map_type] + '3*' \
-        + str(time.year).zfill(4) \
-        + str(time.month).zfill(2) \
-        + str(time.day).zfill(2) \
-        + str(time.hour//2*2).zfill(2) + '*'
-    # adapt4[0,1]3*yyyymmddhh
-    filenames = ftp.nlst(file_pattern)
-
-    if len(filenames) < 1:
-        daily_filenames = ftp.nlst(file_pattern[:-3] + '*')
-        raise FileNotFoundError('Could not find a file that matches the hour',
-                                'Time entered: ' + str(time),
-                                'Files found from same day:',
-                                *[fname[18:30] for fname in daily_filenames],
-                                )
+    # One session can list maps for several times
+    times = time if isinstance(time, (list, tuple)) else [time]
 
     directory = kwargs.get('download_dir', './')
     if not directory.endswith('/'):
         directory += '/'
 
-    # Download files
-    for filename in filenames:
-
-        # Only try to download if the file does not exist
-        if not os.path.isfile(directory+filename.replace('.gz', '')):
-            with open(directory + filename, 'wb') as fhandle:
-                # download magnetogram
-                try:
-                    ftp.retrbinary('RETR ' + filename, fhandle.write)
-                except ftplib.all_errors as err:
-                    ftp.quit()
-                    raise FileNotFoundError(f'Cannot download {filename}') from err
-            if '.gz' in filename:
-                _ungzip(directory + filename)
-        else:
-            warnings.warn(f'{filename} exists, not downloading.',
+    # Establish ftp connection; all listings reuse it
+    ftp = ftplib.FTP('gong2.nso.edu')
+    ftp.login()
+
+    filenames = []
+    to_download = []  # (filename, year_dir) pairs
+    current_year = None
+    for the_time in times:
+        year_dir = str(the_time.year)
+        if year_dir != current_year:
+            try:
+                ftp.cwd('/adapt/maps/gong/' + year_dir)
+            except ftplib.all_errors as err:
+                ftp.quit()
+                raise NotADirectoryError('Cannot go to the specific year directory') from err
+            current_year = year_dir
+
+        # ADAPT maps only contains the hours for even numbers
+        even_hour = the_time.hour & ~1  # Round down to even, branch free
+        if the_time.hour != even_hour:
+            warnings.warn('Warning: Hour must be an even number. '
+                          + 'The entered hour value is changed to '
+                          + f'{even_hour}',
                           RuntimeWarning)
+        # Only consider the public (4) Carrington Fixed (0) GONG (3)
+        # ADAPT maps
+        file_pattern = (f'adapt4{map_id[map_type]}3*{the_time.year:04d}'
+                        + f'{the_time.month:02d}{the_time.day:02d}'
+                        + f'{even_hour:02d}*')
+        # adapt4[0,1]3*yyyymmddhh
+        found = ftp.nlst(file_pattern)
+
+        if len(found) < 1:
+            daily_filenames = ftp.nlst(file_pattern[:-3] + '*')
+            raise FileNotFoundError(
+                'Could not find a file that matches the hour',
+                'Time entered: ' + str(the_time),
+                'Files found from same day:',
+                *[fname[18:30] for fname in daily_filenames],
+                )
+        filenames += found
+
+        # Only try to download files that do not exist
+        for filename in found:
+            if os.path.isfile(directory+filename.replace('.gz', '')):
+                warnings.warn(f'{filename} exists, not downloading.',
+                              RuntimeWarning)
+            else:
+                to_download.append((filename, year_dir))
 
     ftp.quit()
 
+    # Each worker opens its own ftp connection so transfers overlap
+    if to_download:
+        with ThreadPoolExecutor(
+                max_workers=min(4, len(to_download))) as executor:
+            jobs = [executor.submit(_download_adapt_file,
+                                    filename, directory, year_dir)
+                    for filename, year_dir in to_download]
+            for job in jobs:
+                job.result()  # Reraises download errors
+
     return [filename.replace('.gz', '') for filename in filenames]
 
-def _ungzip(filename):
-    """Decompress a gzipped file and delete the compressed file."""
-    filename_unzip = filename.replace('.gz', '')
-    with gzip.open(filename, 'rb') as s_file:
-        with open(filename_unzip, 'wb') as d_file:
-            shutil.copyfileobj(s_file, d_file, 65536)
-    os.remove(filename)
+
+def _download_adapt_file(filename, directory, year_dir):
+    """Downloads one ADAPT magnetogram on its own ftp connection."""
+    ftp = ftplib.FTP('gong2.nso.edu')
+    ftp.login()
+    ftp.cwd('adapt/maps/gong')
+    ftp.cwd(year_dir)
+    buffer = io.BytesIO()
+    try:
+        ftp.retrbinary('RETR ' + filename, buffer.write)
+    except ftplib.all_errors as err:
+        raise FileNotFoundError(f'Cannot download {filename}') from err
+    finally:
+        ftp.quit()
+    buffer.seek(0)
+    if '.gz' in filename:
+        # Decompress straight out of memory so the .gz never touches
+        # disk; only the unzipped map gets written
+        with gzip.open(buffer, 'rb') as s_file:
+            with open(directory + filename.replace('.gz', ''),
+                      'wb') as d_file:
+                shutil.copyfileobj(s_file, d_file, 1 << 20)
+    else:
+        with open(directory + filename, 'wb') as d_file:
+            d_file.write(buffer.getbuffer())